@@ -1,73 +1,169 @@
 # api_server.py
 
-from flask import Flask, request, jsonify
-from app import ask_rag_question # Import the core RAG function from app.py
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from app import MAX_BATCH_QUERIES, ask_rag_question_async, ask_rag_question_stream_async, ask_rag_batch_async, warm_up_gemini_async # Import the core RAG functions from app.py
+import logging
 import os
 import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Configured at import rather than under __main__: initialization below starts logging as soon as
+# the module loads. LOGLEVEL=DEBUG shows per-request detail; at INFO those calls cost a level check.
+logging.basicConfig(level=os.getenv('LOGLEVEL', 'INFO'))
+log = logging.getLogger(__name__)
+
+async def _finish_initialization():
+    """Waits for the init executor, then primes the async Gemini client on the server's event loop."""
+    try:
+        await asyncio.wrap_future(_init_future)
+    except Exception:
+        return # Already logged; /status and the middleware report the failure
+    try:
+        await warm_up_gemini_async()
+    except Exception as e:
+        # Warmup only saves latency; the system can still serve queries without it
+        log.warning("--- Async Gemini warmup failed: %s ---", e)
+    _ready.set()
+    log.info("--- RAG system initialized and ready! ---")
 
-app = Flask(__name__)
+@asynccontextmanager
+async def lifespan(app):
+    # Runs in the background so that /status is served while the system initializes
+    task = asyncio.create_task(_finish_initialization())
+    yield
+    task.cancel()
 
-# A flag to indicate if the RAG system is ready
-rag_system_ready = False
-rag_init_lock = threading.Lock()
+app = FastAPI(title="RAG Chatbot API", lifespan=lifespan)
+
+class AskRequest(BaseModel):
+    query: Optional[str] = None
+
+class AskBatchRequest(BaseModel):
+    queries: Optional[List[str]] = None
 
 def initialize_rag_system():
-    """Initializes the RAG system in a separate thread."""
-    global rag_system_ready
-    with rag_init_lock:
-        if not rag_system_ready:
-            print("--- Initializing RAG system (may take a while)... ---")
-            try:
-                # Call a function from app.py that triggers ChromaDB loading/indexing
-                from app import get_chroma_collection
-                get_chroma_collection()
-                rag_system_ready = True
-                print("--- RAG system initialized and ready! ---")
-            except Exception as e:
-                print(f"--- RAG system initialization FAILED: {e} ---")
-                # You might want to handle this more robustly, e.g., exit or retry
-                os._exit(1) # Exit the process if initialization fails
-
-
-@app.before_request
-def check_rag_status():
-    global rag_system_ready
-    if not rag_system_ready:
-        if not rag_init_lock.locked():
-            # Start initialization in a separate thread if not already running
-            print("Starting RAG system initialization in background...")
-            threading.Thread(target=initialize_rag_system).start()
+    """Initializes the RAG system. Runs exactly once, on the init executor."""
+    log.info("--- Initializing RAG system (may take a while)... ---")
+    try:
+        # Call a function from app.py that triggers vector store loading/indexing
+        from app import get_vector_store, warm_up_rag_system
+        get_vector_store()
+    except Exception as e:
+        log.error("--- RAG system initialization FAILED: %s ---", e)
+        raise # Kept on _init_future so /status can report it
+    try:
+        warm_up_rag_system()
+    except Exception as e:
+        # Warmup only saves latency; the system can still serve queries without it
+        log.warning("--- RAG system warmup failed: %s ---", e)
+    # _ready is set by _finish_initialization once the async Gemini client is primed as well
+
+# Initialization is submitted once at import, so concurrent requests can never start it twice
+_ready = threading.Event()
+_init_executor = ThreadPoolExecutor(max_workers=1)
+_init_future = _init_executor.submit(initialize_rag_system)
+
+
+@app.middleware("http")
+async def check_rag_status(request: Request, call_next):
+    # /status reports initialization progress itself, so it is always served
+    if not _ready.is_set() and request.url.path != "/status":
+        if _init_future.done() and _init_future.exception() is not None:
+            # Retrying will not help; the server has to be fixed and restarted
+            return JSONResponse({"error": f"RAG system initialization failed: {_init_future.exception()}"}, status_code=500)
         # Return a temporary message while initializing
-        return jsonify({"message": "RAG system is initializing. Please try again in a moment."}), 503 # Service Unavailable
+        return JSONResponse({"message": "RAG system is initializing. Please try again in a moment."}, status_code=503) # Service Unavailable
+    return await call_next(request)
+
+
+# Same wording as the checks in the handlers, for bodies that parse as JSON but have a field of the wrong type
+_FIELD_ERRORS = {
+    "query": "'query' must be a string",
+    "queries": "'queries' must be a non-empty list of strings",
+}
+
+@app.exception_handler(RequestValidationError)
+async def invalid_request(request: Request, exc: RequestValidationError):
+    error = exc.errors()[0]
+    loc = error["loc"]
+    if error["type"] in ("json_invalid", "missing") and loc[:1] == ("body",) and len(loc) <= 2:
+        # Unparseable or empty body
+        message = "Request must be JSON"
+    elif loc == ("body",):
+        # A non-JSON content type arrives as raw bytes; valid JSON that is not an object arrives parsed
+        message = "Request must be JSON" if isinstance(error["input"], bytes) else "Request body must be a JSON object"
+    else:
+        field = loc[1]
+        message = _FIELD_ERRORS.get(field, f"Invalid '{field}' parameter: {error['msg']}")
+    return JSONResponse({"error": message}, status_code=400)
+
+
+@app.post('/ask')
+async def ask(req: AskRequest):
+    query = req.query
+
+    if not query:
+        return JSONResponse({"error": "Missing 'query' parameter"}, status_code=400)
+
+    log.debug("Received query via API: '%s'", query)
+    response_text = await ask_rag_question_async(query)
+    log.debug("Sending response via API: '%.100s...'", response_text)
 
+    return {"answer": response_text}
 
-@app.route('/ask', methods=['POST'])
-def ask():
-    if not request.is_json:
-        return jsonify({"error": "Request must be JSON"}), 400
+def _sse_event(text):
+    """Formats text as one Server-Sent Event; each line of the text becomes a 'data:' field."""
+    return "".join(f"data: {line}\n" for line in text.split("\n")) + "\n"
 
-    data = request.get_json()
-    query = data.get('query')
+@app.post('/ask_stream')
+async def ask_stream(req: AskRequest):
+    query = req.query
 
     if not query:
-        return jsonify({"error": "Missing 'query' parameter"}), 400
+        return JSONResponse({"error": "Missing 'query' parameter"}, status_code=400)
+
+    log.debug("Received streaming query via API: '%s'", query)
+
+    async def events():
+        async for text in ask_rag_question_stream_async(query):
+            yield _sse_event(text)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post('/ask_batch')
+async def ask_batch(req: AskBatchRequest):
+    queries = req.queries
+
+    if not queries or not all(queries):
+        return JSONResponse({"error": "'queries' must be a non-empty list of strings"}, status_code=400)
+    if len(queries) > MAX_BATCH_QUERIES:
+        # One request must not be able to queue an unbounded number of Gemini calls
+        return JSONResponse({"error": f"'queries' may contain at most {MAX_BATCH_QUERIES} questions"}, status_code=400)
 
-    print(f"Received query via API: '{query}'")
-    response_text = ask_rag_question(query)
-    print(f"Sending response via API: '{response_text[:100]}...'")
+    log.debug("Received batch of %d queries via API", len(queries))
+    answers = await ask_rag_batch_async(queries)
+    log.debug("Sending %d batched answers via API", len(answers))
 
-    return jsonify({"answer": response_text})
+    return {"answers": answers}
 
-@app.route('/status', methods=['GET'])
-def status():
-    global rag_system_ready
-    if rag_system_ready:
-        return jsonify({"status": "ready", "message": "RAG system is fully initialized and operational."})
+@app.get('/status')
+async def status():
+    if _ready.is_set():
+        return {"status": "ready", "message": "RAG system is fully initialized and operational."}
+    elif _init_future.done() and _init_future.exception() is not None:
+        return {"status": "failed", "message": f"RAG system initialization failed: {_init_future.exception()}. Check the server logs and restart."}
     else:
-        return jsonify({"status": "initializing", "message": "RAG system is currently loading knowledge base and embeddings. Please wait."})
+        return {"status": "initializing", "message": "RAG system is currently loading knowledge base and embeddings. Please wait."}
 
 if __name__ == '__main__':
-    # Start initialization in a separate thread immediately
-    threading.Thread(target=initialize_rag_system).start()
-    print("Flask API starting on http://127.0.0.1:5000")
-    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=False)
\ No newline at end of file
+    log.info("FastAPI server starting on http://127.0.0.1:5000")
+    # A single worker holds many in-flight Gemini calls on one event loop; "auto" picks uvloop where available
+    uvicorn.run(app, host='0.0.0.0', port=5000, workers=1, loop="auto")
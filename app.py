@@ -1,11 +1,27 @@
-# app.py (Regenerated with adjusted chunking, more results, softened prompt, and debug prints)
+# app.py (Regenerated with adjusted chunking, more results, and softened prompt)
 
+import asyncio
+import io
+import logging
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
+from aiolimiter import AsyncLimiter
+from google.api_core import exceptions as google_exceptions
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
+import tiktoken
 import google.generativeai as genai
-import chromadb
-from chromadb.utils import embedding_functions
 from dotenv import load_dotenv
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from rank_bm25 import BM25Okapi
+from tqdm import tqdm
+import embedding_cache
+from backend import ChromaAnswerCache, ChromaStore, SqliteVecAnswerCache, SqliteVecStore
+
+log = logging.getLogger(__name__)
 
 # --- Configuration ---
 # Load environment variables from .env file
@@ -18,163 +34,620 @@ if not GOOGLE_API_KEY:
 
 genai.configure(api_key=GOOGLE_API_KEY)
 
+# Vector store holding the knowledge base: "chroma" (default) or "sqlite-vec"
+VECTOR_BACKEND = os.getenv("BACKEND", "chroma")
+
 # Define the path for your ChromaDB persistence
 CHROMA_DB_PATH = "./chroma_db"
+SQLITE_VEC_PATH = "./vectors.db" # Used when BACKEND=sqlite-vec
 COLLECTION_NAME = "pride_and_prejudice_knowledge" # Keep this consistent
+QA_CACHE_COLLECTION_NAME = "qa_cache" # Previously answered questions, for the semantic cache
 KNOWLEDGE_FILE = "data/knowledgebase.txt" # This should point to your large novel file
 
 # --- RAG Parameter Adjustments ---
 CHUNK_SIZE = 700  # Adjusted chunk size (potentially more precise)
 CHUNK_OVERLAP = 70 # Adjusted overlap
+CHUNKER_VERSION = 2 # Bump whenever load_and_chunk_document changes where chunks are split
 N_RESULTS_RETRIEVAL = 10 # Increased number of retrieved documents
+N_CONTEXT_DOCUMENTS = 5 # Retrieved documents kept for the prompt after de-duplication and BM25 re-ranking
+MAX_CONTEXT_TOKENS = 2048 # Token budget for the retrieved context in each prompt
+RETRIEVAL_CACHE_SIZE = 512 # Recent queries whose retrieved documents are kept in memory
+INGEST_BATCH_SIZE = 100 # Chunks per Gemini embedding call and per vector store add call during indexing
+INGEST_WORKERS = 16 # Concurrent Gemini embedding calls during indexing
+MAX_BATCH_QUERIES = 8 # Questions marshaled into a single Gemini prompt by ask_rag_batch_async
 GEMINI_MODEL = 'gemini-1.5-flash'
+EMBEDDING_MODEL = "models/text-embedding-004" # Must match the model the collection was indexed with
+EMBEDDING_DIMENSIONS = 768 # Output size of EMBEDDING_MODEL
+# Recorded with the indexed chunks; when it no longer matches, the vector store is rebuilt on startup.
+# Vectors from different embedding models can have the same size, so a stale index would not error out.
+INDEX_KEY = f"{EMBEDDING_MODEL}|chunker={CHUNKER_VERSION}|chunk_size={CHUNK_SIZE}|chunk_overlap={CHUNK_OVERLAP}"
 GEMINI_TEMPERATURE = 0.3 # Temperature allowing for some synthesis
+GEMINI_MAX_REQUESTS_PER_SECOND = 8 # 480 requests/min, just under the provider's ~500 RPM limit
+GEMINI_MAX_ATTEMPTS = 5 # Attempts per Gemini call when it is rate limited or temporarily unavailable
+
+# --- HNSW Index Tuning ---
+# Applied when the Chroma collection is created. Defaults (M=16, construction_ef=100, search_ef=10) give
+# mediocre recall at N_RESULTS_RETRIEVAL=10; the graph walk is spread across all cores.
+HNSW_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:construction_ef": 200,
+    "hnsw:M": 32,
+    "hnsw:search_ef": 64,
+    "hnsw:num_threads": os.cpu_count(),
+}
+
+# --- Warmup ---
+WARMUP_QUERIES = ["Who is Elizabeth?", "Who is Darcy?"] # Answered during startup to fill the embedding and answer caches
+
+# --- Semantic Cache ---
+QA_CACHE_MAX_DISTANCE = 0.05 # Cosine distance below which a cached answer is reused (similarity >= 0.95)
+QA_CACHE_TTL_SECONDS = 7 * 86400 # Cached answers older than a week are swept
 
 # --- Global/Cached Variables ---
-_chroma_collection = None
+_vector_store = None
+_qa_cache = None
 _gemini_model = None
 
-# --- 1. Load and Process Data (Using LangChain's Text Splitter) ---
+# cl100k_base only approximates Gemini's tokenizer, but counting locally avoids a count_tokens API call per prompt
+_token_encoder = tiktoken.get_encoding("cl100k_base")
+
+# --- 0. Gemini Rate Limiting and Retries ---
+_gemini_limiter = AsyncLimiter(max_rate=GEMINI_MAX_REQUESTS_PER_SECOND, time_period=1)
+_sync_rate_lock = threading.Lock()
+_next_sync_call = 0.0
+
+# Only quota (429) and availability (503) errors are retried; anything else fails immediately
+_retry_transient = retry(
+    stop=stop_after_attempt(GEMINI_MAX_ATTEMPTS),
+    wait=wait_exponential_jitter(initial=0.5, max=8),
+    retry=retry_if_exception_type((google_exceptions.ResourceExhausted, google_exceptions.ServiceUnavailable)),
+    reraise=True
+)
+
+def _throttle_sync():
+    """Spaces synchronous Gemini calls (made from worker threads) at GEMINI_MAX_REQUESTS_PER_SECOND."""
+    global _next_sync_call
+    with _sync_rate_lock:
+        now = time.monotonic()
+        delay = _next_sync_call - now
+        _next_sync_call = max(now, _next_sync_call) + 1 / GEMINI_MAX_REQUESTS_PER_SECOND
+    if delay > 0:
+        time.sleep(delay)
+
+@_retry_transient
+def _generate_content(prompt, **kwargs):
+    """Rate-limited, retried model.generate_content."""
+    _throttle_sync()
+    return get_gemini_model().generate_content(prompt, **kwargs)
+
+@_retry_transient
+async def _generate_content_async(prompt, **kwargs):
+    """Rate-limited, retried model.generate_content_async."""
+    async with _gemini_limiter:
+        return await get_gemini_model().generate_content_async(prompt, **kwargs)
+
+# --- 1. Load and Process Data (Sentence-Packing Splitter) ---
+# Paragraph breaks, or whitespace after sentence-ending punctuation when the next sentence starts
+# with a capital letter or an opening quote. Splitting runs in the C regex engine in one pass.
+_SENTENCE_BOUNDARY = re.compile(r'\n\s*\n|(?<=[.!?])\s+(?=[A-Z"\'\u201c\u2018_])')
+
 def load_and_chunk_document(file_path, chunk_size, chunk_overlap):
-    """Loads a text file and splits it into chunks using LangChain's RecursiveCharacterTextSplitter."""
-    print(f"Loading and chunking '{file_path}' using RecursiveCharacterTextSplitter with chunk_size={chunk_size}, overlap={chunk_overlap}...")
+    """
+    Loads a text file and splits it into chunks of at most chunk_size characters by greedily
+    packing whole sentences, carrying the last chunk_overlap characters into the next chunk.
+    """
+    log.info("Loading and chunking '%s' with chunk_size=%d, overlap=%d...", file_path, chunk_size, chunk_overlap)
     with open(file_path, "r", encoding="utf-8") as f:
         text = f.read()
 
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=len,
-        is_separator_regex=False,
-    )
-    chunks = text_splitter.split_text(text)
-    print(f"Text loaded and split into {len(chunks)} chunks.")
+    # Sentences longer than this are hard-split so that overlap + sentence always fits in a chunk
+    max_piece = chunk_size - chunk_overlap - 1
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_BOUNDARY.split(text):
+        sentence = sentence.strip()
+        for start in range(0, len(sentence), max_piece):
+            piece = sentence[start:start + max_piece].strip()
+            if not piece:
+                continue
+            if not current:
+                current = piece
+            elif len(current) + 1 + len(piece) <= chunk_size:
+                current = f"{current} {piece}"
+            else:
+                chunks.append(current)
+                # Start the overlap on a word boundary rather than mid-word; a tail holding a single
+                # (possibly cut) word is not carried over at all
+                parts = current[-chunk_overlap:].split(maxsplit=1) if chunk_overlap else []
+                overlap = parts[1] if len(parts) == 2 else ""
+                current = f"{overlap} {piece}" if overlap else piece
+    if current:
+        chunks.append(current)
+
+    log.info("Text loaded and split into %d chunks.", len(chunks))
     return chunks
 
-# --- 2. Initialize ChromaDB and Embeddings ---
-def get_chroma_collection():
-    """Initializes and returns the ChromaDB collection (cached)."""
-    global _chroma_collection
-    if _chroma_collection is None:
-        print("Initializing ChromaDB collection...")
-        gemini_ef = embedding_functions.GoogleGenerativeAiEmbeddingFunction(api_key=GOOGLE_API_KEY)
-        client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-        collection = client.get_or_create_collection(
-            name=COLLECTION_NAME,
-            embedding_function=gemini_ef
-        )
-
-        if collection.count() == 0:
-            print("Collection is empty. Loading and adding documents...")
+# --- 2. Initialize Vector Store and Embeddings ---
+@_retry_transient
+def embed_batch(texts, task_type):
+    """
+    Embeds a list of up to INGEST_BATCH_SIZE texts with one Gemini API call. Chroma's embedding
+    function would instead make one call per text.
+    """
+    _throttle_sync()
+    return genai.embed_content(model=EMBEDDING_MODEL, content=texts, task_type=task_type)['embedding']
+
+def compute_embeddings(chunks):
+    """
+    Returns embeddings for document chunks, keyed by content in the embedding cache,
+    so only chunks that were never embedded before reach the Gemini API.
+    """
+    namespace = f"{EMBEDDING_MODEL}:retrieval_document"
+    vecs = embedding_cache.get_many(chunks, namespace=namespace)
+    missing = [i for i, vec in enumerate(vecs) if vec is None]
+    log.info("%d of %d chunk embeddings found in cache.", len(chunks) - len(missing), len(chunks))
+
+    def embed(batch):
+        texts = [chunks[i] for i in batch]
+        embeddings = embed_batch(texts, "retrieval_document")
+        embedding_cache.put_many(texts, embeddings, namespace=namespace)
+        return batch, embeddings
+
+    batches = [missing[i:i + INGEST_BATCH_SIZE] for i in range(0, len(missing), INGEST_BATCH_SIZE)]
+    # Batches are embedded in parallel; iterating the results surfaces any API error here
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+        for batch, embeddings in tqdm(executor.map(embed, batches), total=len(batches), desc="Embedding chunks"):
+            for i, vec in zip(batch, embeddings):
+                vecs[i] = vec
+    return [np.asarray(vec, dtype=np.float32).tolist() for vec in vecs]
+
+def _open_vector_store():
+    """Opens the vector store selected by the BACKEND environment variable."""
+    if VECTOR_BACKEND == "chroma":
+        return ChromaStore(CHROMA_DB_PATH, COLLECTION_NAME, metadata={**HNSW_METADATA, "index_key": INDEX_KEY})
+    if VECTOR_BACKEND == "sqlite-vec":
+        return SqliteVecStore(SQLITE_VEC_PATH, EMBEDDING_DIMENSIONS)
+    raise ValueError(f"Unknown BACKEND '{VECTOR_BACKEND}'. Please set it to 'chroma' or 'sqlite-vec'.")
+
+def get_vector_store():
+    """Initializes and returns the knowledge-base vector store, indexing the documents if it is empty (cached)."""
+    global _vector_store
+    if _vector_store is None:
+        log.info("Initializing vector store (backend: %s)...", VECTOR_BACKEND)
+        store = _open_vector_store()
+
+        if store.index_key() != INDEX_KEY:
+            if store.count() > 0:
+                log.warning("Vector store was indexed with '%s' but the current settings are '%s'. Re-indexing...", store.index_key(), INDEX_KEY)
+            store.reset(INDEX_KEY)
+
+        if store.count() == 0:
+            log.info("Vector store is empty. Loading and adding documents...")
             document_chunks = load_and_chunk_document(KNOWLEDGE_FILE, CHUNK_SIZE, CHUNK_OVERLAP)
             if document_chunks:
                 ids = [f"doc_{i}" for i in range(len(document_chunks))]
-                collection.add(
-                    documents=document_chunks,
-                    ids=ids
-                )
-                print(f"Added {len(document_chunks)} chunks to ChromaDB.")
+                embeddings = compute_embeddings(document_chunks)
+                for i in range(0, len(document_chunks), INGEST_BATCH_SIZE):
+                    store.add(
+                        ids=ids[i:i + INGEST_BATCH_SIZE],
+                        documents=document_chunks[i:i + INGEST_BATCH_SIZE],
+                        embeddings=embeddings[i:i + INGEST_BATCH_SIZE]
+                    )
+                _cached_retrieve.cache_clear()
+                log.info("Added %d chunks to the vector store.", len(document_chunks))
             else:
-                print("No document chunks to add.")
+                log.warning("No document chunks to add.")
         else:
-            print(f"ChromaDB collection '{COLLECTION_NAME}' already exists with {collection.count()} documents. Skipping indexing.")
-        _chroma_collection = collection
-    return _chroma_collection
+            log.info("Vector store '%s' already exists with %d documents. Skipping indexing.", COLLECTION_NAME, store.count())
+        _vector_store = store
+    return _vector_store
+
+# --- 2b. Semantic Answer Cache ---
+def _open_qa_cache():
+    """Opens the semantic answer cache in the backend selected by the BACKEND environment variable."""
+    if VECTOR_BACKEND == "chroma":
+        # The similarity threshold is a cosine distance
+        return ChromaAnswerCache(CHROMA_DB_PATH, QA_CACHE_COLLECTION_NAME, metadata={"hnsw:space": "cosine", "index_key": EMBEDDING_MODEL})
+    if VECTOR_BACKEND == "sqlite-vec":
+        return SqliteVecAnswerCache(SQLITE_VEC_PATH, EMBEDDING_DIMENSIONS)
+    raise ValueError(f"Unknown BACKEND '{VECTOR_BACKEND}'. Please set it to 'chroma' or 'sqlite-vec'.")
+
+def get_qa_cache():
+    """Initializes and returns the store of cached answers (cached)."""
+    global _qa_cache
+    if _qa_cache is None:
+        log.info("Initializing semantic answer cache (backend: %s)...", VECTOR_BACKEND)
+        qa_cache = _open_qa_cache()
+        if qa_cache.index_key() != EMBEDDING_MODEL:
+            # Questions embedded with another model would match unrelated new questions
+            if qa_cache.count() > 0:
+                log.warning("Semantic answer cache was built with a different embedding model. Clearing it...")
+            qa_cache.reset(EMBEDDING_MODEL)
+        _qa_cache = qa_cache
+        sweep_qa_cache()
+    return _qa_cache
+
+def sweep_qa_cache():
+    """Deletes cached answers older than QA_CACHE_TTL_SECONDS."""
+    get_qa_cache().sweep(time.time() - QA_CACHE_TTL_SECONDS)
+
+def lookup_cached_answer(query):
+    """Returns a cached answer to a semantically equivalent question, or None."""
+    qa_cache = get_qa_cache()
+    if qa_cache.count() == 0:
+        return None
+    nearest = qa_cache.nearest(embed_query(query).tolist())
+    if nearest is None:
+        return None
+    distance, answer, ts = nearest
+    if distance >= QA_CACHE_MAX_DISTANCE:
+        return None
+    if ts < time.time() - QA_CACHE_TTL_SECONDS:
+        return None
+    log.debug("Semantic cache hit for query: '%s' (distance %.4f)", query, distance)
+    return answer
+
+def store_cached_answer(query, answer):
+    """Adds a freshly generated answer to the semantic cache."""
+    get_qa_cache().add(query, embed_query(query).tolist(), answer, time.time())
 
 # --- 3. Retrieval Function ---
-def retrieve_relevant_documents(query, collection, n_results=N_RESULTS_RETRIEVAL):
-    """Retrieves top_k most similar documents from ChromaDB based on a query."""
-    print(f"Retrieving {n_results} relevant documents for query: '{query}'")
-    results = collection.query(
-        query_texts=[query],
-        n_results=n_results
-    )
-    return results['documents'][0] if results['documents'] else []
+def embed_query(query):
+    """Returns the embedding for a query, consulting the on-disk embedding cache first."""
+    namespace = f"{EMBEDDING_MODEL}:retrieval_query"
+    vec = embedding_cache.get(query, namespace=namespace)
+    if vec is None:
+        vec = np.asarray(embed_batch([query], "retrieval_query")[0], dtype=np.float32)
+        embedding_cache.put(query, vec, namespace=namespace)
+    return vec
+
+def embed_queries(queries):
+    """
+    Embeds the queries missing from the embedding cache with batched Gemini calls and caches them,
+    so embed_query is a cache hit for each of them afterwards.
+    """
+    namespace = f"{EMBEDDING_MODEL}:retrieval_query"
+    unique = list(dict.fromkeys(queries))
+    misses = [query for query, vec in zip(unique, embedding_cache.get_many(unique, namespace=namespace)) if vec is None]
+    for start in range(0, len(misses), INGEST_BATCH_SIZE):
+        batch = misses[start:start + INGEST_BATCH_SIZE]
+        embedding_cache.put_many(batch, embed_batch(batch, "retrieval_query"), namespace=namespace)
+
+def retrieve_relevant_documents(query, store, n_results=N_RESULTS_RETRIEVAL):
+    """Retrieves top_k most similar documents from the vector store based on a query."""
+    log.debug("Retrieving %d relevant documents for query: '%s'", n_results, query)
+    vec = embed_query(query)
+    results = store.query(query_embeddings=[vec.tolist()], n_results=n_results)
+    if not results['documents']:
+        return []
+    return select_context_documents(query, results['ids'][0], results['documents'][0])
+
+def _tokenize(text):
+    """Lower-cased word tokens for BM25 scoring."""
+    return re.findall(r"\w+", text.lower())
+
+def select_context_documents(query, ids, docs, top_k=N_CONTEXT_DOCUMENTS):
+    """
+    Drops chunks adjacent to a better-ranked chunk (neighbours share CHUNK_OVERLAP characters and
+    mostly repeat each other), re-ranks the rest with BM25 against the query and keeps the top_k.
+    """
+    kept_positions = []
+    kept_docs = []
+    for doc_id, doc in zip(ids, docs):
+        position = int(doc_id.rsplit("_", 1)[-1]) # ids are "doc_<chunk position>"
+        if any(abs(position - kept) <= 1 for kept in kept_positions):
+            continue
+        kept_positions.append(position)
+        kept_docs.append(doc)
+    if not kept_docs:
+        return []
+
+    scores = BM25Okapi([_tokenize(doc) for doc in kept_docs]).get_scores(_tokenize(query))
+    # sorted() is stable, so ties keep their vector-similarity order
+    ranked = sorted(range(len(kept_docs)), key=lambda i: scores[i], reverse=True)
+    return [kept_docs[i] for i in ranked[:top_k]]
+
+@lru_cache(maxsize=RETRIEVAL_CACHE_SIZE)
+def _cached_retrieve(query):
+    """Memoized retrieval for repeated queries; cleared whenever documents are (re)indexed."""
+    return tuple(retrieve_relevant_documents(query, get_vector_store(), N_RESULTS_RETRIEVAL))
 
 # --- 4. Get Gemini Model Instance ---
 def get_gemini_model():
     """Initializes and returns the Gemini model (cached)."""
     global _gemini_model
     if _gemini_model is None:
-        print(f"Initializing Gemini model: {GEMINI_MODEL}")
+        log.info("Initializing Gemini model: %s", GEMINI_MODEL)
         _gemini_model = genai.GenerativeModel(GEMINI_MODEL)
     return _gemini_model
 
 # --- 5. Main RAG Query Function ---
+# Softened Prompt for better factual adherence and allowing reasonable inference
+_PROMPT_HEADER = """
+    You are an AI assistant tasked with answering questions based on the provided text.
+    Please use the context below to answer the question thoroughly and accurately.
+    If the answer is not available or cannot be reasonably inferred from the provided context,
+    you must state clearly and concisely: "I cannot find the answer to that question in the provided information."
+    Do not introduce any information that is not present in the context."""
+_PROMPT_NO_CONTEXT = "No specific context was provided from the knowledge base.\n"
+_PROMPT_FOOTER = """
+    Question: {query}
+
+    Answer:
+    """
+# Shown in place of an answer whenever Gemini generation fails, on every query path
+_GENERATION_ERROR_MESSAGE = "Sorry, I encountered an error while generating the response."
+
+def fit_token_budget(docs, max_tokens=MAX_CONTEXT_TOKENS):
+    """Keeps the leading (best-ranked) documents whose combined length stays within max_tokens."""
+    kept = []
+    total_tokens = 0
+    for doc in docs:
+        total_tokens += len(_token_encoder.encode_ordinary(doc))
+        if total_tokens > max_tokens:
+            break
+        kept.append(doc)
+    return kept
+
+def _build_prompt(query, retrieved_docs):
+    """Builds the grounded prompt for a single query from its retrieved documents."""
+    retrieved_docs = fit_token_budget(retrieved_docs)
+    # --- Debugging Output for Retrieved Documents (only formatted when DEBUG logging is on) ---
+    if log.isEnabledFor(logging.DEBUG):
+        if retrieved_docs:
+            log.debug("--- Retrieved Documents Sent to LLM (for debugging) ---")
+            for i, doc in enumerate(retrieved_docs):
+                # Limiting output to first 200 chars for readability in terminal
+                log.debug("Document %d (Length: %d):\n'%.200s...'", i + 1, len(doc), doc)
+        else:
+            log.debug("--- No relevant documents retrieved for this query. ---")
+
+    # Written into one buffer instead of joining the context and then copying it into an f-string
+    buf = io.StringIO()
+    buf.write(_PROMPT_HEADER)
+    buf.write("\n\nContext:\n")
+    if retrieved_docs:
+        buf.writelines(doc + "\n" for doc in retrieved_docs)
+    else:
+        buf.write(_PROMPT_NO_CONTEXT)
+    buf.write(_PROMPT_FOOTER.format(query=query))
+    return buf.getvalue()
+
+def _generation_config():
+    """Generation settings shared by every Gemini call."""
+    return genai.types.GenerationConfig(temperature=GEMINI_TEMPERATURE)
+
+def _store_answer(query, answer):
+    """Stores an answer in the semantic cache; a cache write failure must not cost the user their answer."""
+    try:
+        store_cached_answer(query, answer)
+    except Exception as e:
+        log.error("Error storing answer in semantic cache: %s", e)
+
 def ask_rag_question(query):
     """
     Combines retrieval and generation to answer a user query using RAG.
     """
-    collection = get_chroma_collection()
-    model = get_gemini_model()
+    cached_answer = lookup_cached_answer(query)
+    if cached_answer is not None:
+        return cached_answer
 
-    retrieved_docs = retrieve_relevant_documents(query, collection, N_RESULTS_RETRIEVAL)
+    retrieved_docs = _cached_retrieve(query)
+    prompt = _build_prompt(query, retrieved_docs)
 
-    # --- Debugging Print for Retrieved Documents ---
-    if retrieved_docs:
-        print("\n--- Retrieved Documents Sent to LLM (for debugging) ---")
-        for i, doc in enumerate(retrieved_docs):
-            # Limiting print to first 200 chars for readability in terminal
-            print(f"Document {i+1} (Length: {len(doc)}):\n'{doc[:200]}...'")
-        print("------------------------------------------")
-    else:
-        print("\n--- No relevant documents retrieved for this query. ---")
-        print("------------------------------------------")
-    # --- End Debugging Print ---
+    log.debug("--- Sending to Gemini LLM ---")
+    # Uncomment for more verbose prompt debugging:
+    # log.debug("Prompt (first 1000 chars):\n%s...", prompt[:1000])
+
+    try:
+        response = _generate_content(prompt, generation_config=_generation_config())
+        answer = response.text
+    except Exception as e:
+        log.error("Error generating content with Gemini: %s", e)
+        return _GENERATION_ERROR_MESSAGE
+
+    _store_answer(query, answer)
+    return answer
+
+async def ask_rag_question_async(query):
+    """
+    Async variant of ask_rag_question for the API server's event loop.
+    Chroma and the embedding cache are synchronous, so they run in worker threads.
+    """
+    cached_answer = await asyncio.to_thread(lookup_cached_answer, query)
+    if cached_answer is not None:
+        return cached_answer
+
+    retrieved_docs = await asyncio.to_thread(_cached_retrieve, query)
+    prompt = _build_prompt(query, retrieved_docs)
+
+    log.debug("--- Sending to Gemini LLM (async) ---")
+    try:
+        response = await _generate_content_async(prompt, generation_config=_generation_config())
+        answer = response.text
+    except Exception as e:
+        log.error("Error generating content with Gemini: %s", e)
+        return _GENERATION_ERROR_MESSAGE
+
+    await asyncio.to_thread(_store_answer, query, answer)
+    return answer
+
+async def ask_rag_question_stream_async(query):
+    """
+    Streaming variant of ask_rag_question_async: yields the answer in pieces as Gemini
+    generates it, so callers can show the first tokens before generation finishes.
+    """
+    cached_answer = await asyncio.to_thread(lookup_cached_answer, query)
+    if cached_answer is not None:
+        yield cached_answer
+        return
+
+    retrieved_docs = await asyncio.to_thread(_cached_retrieve, query)
+    prompt = _build_prompt(query, retrieved_docs)
+
+    log.debug("--- Streaming from Gemini LLM (async) ---")
+    parts = []
+    try:
+        response = await _generate_content_async(prompt, generation_config=_generation_config(), stream=True)
+        async for chunk in response:
+            parts.append(chunk.text)
+            yield chunk.text
+    except Exception as e:
+        log.error("Error generating content with Gemini: %s", e)
+        separator = "\n\n" if parts else ""
+        yield separator + _GENERATION_ERROR_MESSAGE
+        return
+
+    # An empty stream is not cached: it would be served as a blank answer to similar questions
+    answer = "".join(parts)
+    if answer:
+        await asyncio.to_thread(_store_answer, query, answer)
 
-    context = "\n".join(retrieved_docs) if retrieved_docs else ""
+# --- 6. Batched RAG Query Function ---
+# Tolerates markdown around the label, e.g. "**A1:**", "A1 :" or "### A1:"
+_BATCH_ANSWER_PATTERN = re.compile(r"^[*_#\s]*A(\d+)[*_\s]*:[*_]*", re.MULTILINE)
 
-    # Softened Prompt for better factual adherence and allowing reasonable inference
-    prompt = f"""
+def _build_batch_prompt(queries, contexts):
+    """Marshals several questions and their retrieved contexts into one numbered prompt."""
+    sections = []
+    for i, (query, docs) in enumerate(zip(queries, contexts), start=1):
+        context = "\n".join(docs) if docs else "No specific context was provided from the knowledge base."
+        sections.append(f"Q{i}: {query}\nContext{i}:\n{context}")
+    questions = "\n\n".join(sections)
+
+    return f"""
     You are an AI assistant tasked with answering questions based on the provided text.
-    Please use the context below to answer the question thoroughly and accurately.
-    If the answer is not available or cannot be reasonably inferred from the provided context,
+    For each numbered question below, answer using the per-question context that follows it, thoroughly and accurately.
+    If the answer to a question is not available or cannot be reasonably inferred from its context,
     you must state clearly and concisely: "I cannot find the answer to that question in the provided information."
     Do not introduce any information that is not present in the context.
+    Start each answer on a new line with its number, in the form "A1: ...", "A2: ...", and answer every question.
 
-    Context:
-    {context if context else "No specific context was provided from the knowledge base."}
-
-    Question: {query}
+    {questions}
 
-    Answer:
+    Answers:
     """
 
-    print("\n--- Sending to Gemini LLM ---")
-    # Uncomment for more verbose prompt debugging:
-    # print(f"Prompt (first 1000 chars):\n{prompt[:1000]}...")
+def _parse_batch_response(text, n_queries):
+    """Splits a numbered 'A<n>:' response back into one answer per question."""
+    answers = [None] * n_queries
+    matches = list(_BATCH_ANSWER_PATTERN.finditer(text))
+    for match, next_match in zip(matches, matches[1:] + [None]):
+        index = int(match.group(1)) - 1
+        end = next_match.start() if next_match else len(text)
+        if 0 <= index < n_queries and answers[index] is None:
+            answers[index] = text[match.end():end].strip()
+    return answers
+
+def _retrieve_batch_prompt(queries):
+    """Retrieves context for every query in one vectorized store query and builds the batch prompt."""
+    store = get_vector_store()
+
+    log.debug("Retrieving %d relevant documents for %d batched queries", N_RESULTS_RETRIEVAL, len(queries))
+    results = store.query(
+        query_embeddings=[embed_query(query).tolist() for query in queries],
+        n_results=N_RESULTS_RETRIEVAL
+    )
+    if results['documents']:
+        contexts = [
+            fit_token_budget(select_context_documents(query, ids, docs))
+            for query, ids, docs in zip(queries, results['ids'], results['documents'])
+        ]
+    else:
+        contexts = [[] for _ in queries]
+    return _build_batch_prompt(queries, contexts)
+
+def _finish_batch(queries, response_text):
+    """Parses a batch response and caches the answers that came back; unparsed answers are left as None."""
+    answers = _parse_batch_response(response_text, len(queries))
+    for query, answer in zip(queries, answers):
+        if answer:
+            _store_answer(query, answer)
+    return answers
 
+async def _answer_batch_async(queries):
+    """Answers up to MAX_BATCH_QUERIES questions with a single retrieval and generation call."""
+    prompt = await asyncio.to_thread(_retrieve_batch_prompt, queries)
+
+    log.debug("--- Sending batch of %d queries to Gemini LLM (async) ---", len(queries))
     try:
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=GEMINI_TEMPERATURE
-            )
-        )
-        return response.text
+        response = await _generate_content_async(prompt, generation_config=_generation_config())
+        response_text = response.text
     except Exception as e:
-        print(f"Error generating content with Gemini: {e}")
-        return "Sorry, I encountered an error while generating the response."
+        log.error("Error generating batch content with Gemini: %s", e)
+        return [_GENERATION_ERROR_MESSAGE] * len(queries)
+    answers = await asyncio.to_thread(_finish_batch, queries, response_text)
+
+    # Questions whose answer could not be parsed out of the batch response are asked on their own
+    unparsed = [i for i, answer in enumerate(answers) if not answer]
+    if unparsed:
+        log.warning("%d of %d batched answers could not be parsed; asking them individually.", len(unparsed), len(queries))
+        retried = await asyncio.gather(*(ask_rag_question_async(queries[i]) for i in unparsed))
+        for i, answer in zip(unparsed, retried):
+            answers[i] = answer
+    return answers
+
+def _pending_groups(answers):
+    """Indices of unanswered queries, in groups of at most MAX_BATCH_QUERIES."""
+    pending = [i for i, answer in enumerate(answers) if answer is None]
+    return [pending[start:start + MAX_BATCH_QUERIES] for start in range(0, len(pending), MAX_BATCH_QUERIES)]
+
+async def ask_rag_batch_async(queries):
+    """
+    Answers a list of queries, marshaling up to MAX_BATCH_QUERIES of them into each Gemini call.
+    Questions already in the semantic cache are answered without being sent to the LLM, and the
+    per-group Gemini calls are dispatched concurrently.
+    """
+    await asyncio.to_thread(embed_queries, queries)
+    answers = await asyncio.to_thread(lambda: [lookup_cached_answer(query) for query in queries])
+    groups = _pending_groups(answers)
+    group_answers = await asyncio.gather(
+        *(_answer_batch_async([queries[i] for i in group]) for group in groups)
+    )
+    for group, results in zip(groups, group_answers):
+        for i, answer in zip(group, results):
+            answers[i] = answer
+    return answers
+
+# --- 7. Warmup ---
+def warm_up_rag_system():
+    """
+    Opens every cached resource, then pre-answers WARMUP_QUERIES to fill the embedding and answer caches.
+    """
+    get_vector_store()
+    get_qa_cache()
+    for query in WARMUP_QUERIES:
+        ask_rag_question(query)
+
+async def warm_up_gemini_async():
+    """
+    Primes the async Gemini client that serves every API request. Its grpc-asyncio channel is
+    created lazily on the event loop that first uses it, so this must run on the server's loop.
+    """
+    log.info("Warming up async Gemini connection...")
+    await _generate_content_async(
+        "ping",
+        generation_config=genai.types.GenerationConfig(temperature=0, max_output_tokens=1)
+    )
 
 # --- Main block for initial setup (optional, for direct running/testing) ---
 if __name__ == "__main__":
-    print("Running app.py directly for initial setup/testing...")
+    logging.basicConfig(level=os.getenv("LOGLEVEL", "INFO"))
+    log.info("Running app.py directly for initial setup/testing...")
     try:
-        collection = get_chroma_collection()
-        print(f"RAG system ready with {collection.count()} documents.")
+        store = get_vector_store()
+        log.info("RAG system ready with %d documents.", store.count())
 
         # Test query for 'Mr. Collins' proposal'
         test_query_proposer = "Who proposes to Elizabeth first?"
-        print(f"\nTesting with query: '{test_query_proposer}'")
+        log.info("Testing with query: '%s'", test_query_proposer)
         response_proposer = ask_rag_question(test_query_proposer)
-        print("\n--- Test AI Response ---")
-        print(response_proposer)
+        log.info("--- Test AI Response ---\n%s", response_proposer)
 
         test_query_no_info = "What is the capital of France?"
-        print(f"\nTesting with query: '{test_query_no_info}' (should say 'cannot find')")
+        log.info("Testing with query: '%s' (should say 'cannot find')", test_query_no_info)
         response_no_info = ask_rag_question(test_query_no_info)
-        print("\n--- Test AI Response ---")
-        print(response_no_info)
+        log.info("--- Test AI Response ---\n%s", response_no_info)
 
     except Exception as e:
-        print(f"Initialization or test query failed: {e}")
\ No newline at end of file
+        log.error("Initialization or test query failed: %s", e)
\ No newline at end of file
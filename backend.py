@@ -0,0 +1,284 @@
+# backend.py
+
+import sqlite3
+import threading
+from typing import Protocol
+from uuid import uuid4
+
+import numpy as np
+
+class VectorStore(Protocol):
+    """Storage for the knowledge-base chunks and their embeddings."""
+
+    def count(self):
+        """Number of stored chunks."""
+        ...
+
+    def add(self, ids, documents, embeddings):
+        """Stores chunks with precomputed embeddings."""
+        ...
+
+    def query(self, query_embeddings, n_results):
+        """Returns {'ids': [[...]], 'documents': [[...]]} with one inner list per query embedding, nearest first."""
+        ...
+
+    def index_key(self):
+        """Key recorded for the settings the stored chunks were produced and embedded with, or None."""
+        ...
+
+    def reset(self, index_key):
+        """Deletes every stored chunk and records index_key for the chunks added next."""
+        ...
+
+class AnswerCache(Protocol):
+    """Storage for previously answered questions, looked up by the embedding of the question."""
+
+    def count(self):
+        """Number of cached answers."""
+        ...
+
+    def add(self, query, embedding, answer, ts):
+        """Stores an answer with the embedding of its question and the time it was generated."""
+        ...
+
+    def nearest(self, query_embedding):
+        """Returns (distance, answer, ts) for the cached question closest to query_embedding, or None."""
+        ...
+
+    def sweep(self, before_ts):
+        """Deletes answers generated before before_ts."""
+        ...
+
+    def index_key(self):
+        """Key recorded for the embedding model the cached questions were embedded with, or None."""
+        ...
+
+    def reset(self, index_key):
+        """Deletes every cached answer and records index_key for the answers added next."""
+        ...
+
+# --- ChromaDB Backend ---
+class _ChromaCollection:
+    """A persistent ChromaDB collection whose index key is kept in its metadata."""
+
+    def __init__(self, path, name, metadata):
+        # Imported here so that BACKEND=sqlite-vec never loads ChromaDB
+        import chromadb
+
+        self._client = chromadb.PersistentClient(path=path)
+        self._name = name
+        self._metadata = metadata
+        # Adds and queries always pass precomputed embeddings, so the collection has no embedding
+        # function and Chroma can never call the embedding API itself
+        self._collection = self._client.get_or_create_collection(
+            name=name,
+            embedding_function=None,
+            metadata=metadata
+        )
+
+    def count(self):
+        return self._collection.count()
+
+    def index_key(self):
+        return (self._collection.metadata or {}).get("index_key")
+
+    def reset(self, index_key):
+        # Collection metadata holding HNSW settings cannot be edited in place, so the collection is recreated
+        self._client.delete_collection(self._name)
+        self._metadata = {**self._metadata, "index_key": index_key}
+        self._collection = self._client.create_collection(
+            name=self._name,
+            embedding_function=None,
+            metadata=self._metadata
+        )
+
+class ChromaStore(_ChromaCollection):
+    """VectorStore backed by a persistent ChromaDB collection."""
+
+    def __init__(self, path, name, metadata):
+        super().__init__(path, name, metadata)
+        # Space, M and construction_ef are fixed once a collection exists, but search-time settings
+        # can still be raised on collections created before they were configured
+        self._collection.modify(configuration={"hnsw": {
+            "ef_search": metadata["hnsw:search_ef"],
+            "num_threads": metadata["hnsw:num_threads"],
+        }})
+
+    def add(self, ids, documents, embeddings):
+        self._collection.add(ids=ids, documents=documents, embeddings=embeddings)
+
+    def query(self, query_embeddings, n_results):
+        return self._collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=["documents"]
+        )
+
+class ChromaAnswerCache(_ChromaCollection):
+    """AnswerCache backed by a persistent ChromaDB collection; answers and times are kept as metadata."""
+
+    def add(self, query, embedding, answer, ts):
+        self._collection.add(
+            ids=[uuid4().hex],
+            documents=[query],
+            embeddings=[embedding],
+            metadatas=[{'answer': answer, 'ts': ts}]
+        )
+
+    def nearest(self, query_embedding):
+        if self._collection.count() == 0:
+            return None
+        results = self._collection.query(
+            query_embeddings=[query_embedding],
+            n_results=1,
+            include=["metadatas", "distances"]
+        )
+        if not results['distances'] or not results['distances'][0]:
+            return None
+        metadata = results['metadatas'][0][0]
+        return results['distances'][0][0], metadata['answer'], metadata['ts']
+
+    def sweep(self, before_ts):
+        self._collection.delete(where={"ts": {"$lt": before_ts}})
+
+# --- sqlite-vec Backend ---
+class _SqliteVecTables:
+    """
+    A pair of tables in a sqlite-vec database file: rows in a plain table and their vectors in a
+    vec0 virtual table sharing its rowids. The index key is kept in a meta table shared by every pair.
+    """
+
+    _META_KEY = None # Row of the meta table holding this pair's index key
+    _ROWS_TABLE = None
+    _ROWS_COLUMNS = None
+    _VECTORS_TABLE = None
+
+    def __init__(self, path, dimensions):
+        try:
+            import sqlite_vec
+        except ImportError as e:
+            raise ImportError("BACKEND=sqlite-vec requires the sqlite-vec package: pip install sqlite-vec") from e
+
+        self._lock = threading.Lock()
+        self._dimensions = dimensions
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        if not hasattr(self._connection, "enable_load_extension"):
+            raise ImportError(
+                "BACKEND=sqlite-vec requires a Python build that can load SQLite extensions; "
+                "this interpreter's sqlite3 module was compiled without extension support"
+            )
+        self._connection.enable_load_extension(True)
+        sqlite_vec.load(self._connection)
+        self._connection.enable_load_extension(False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._create_tables()
+        self._connection.commit()
+
+    def _create_tables(self):
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {self._ROWS_TABLE} (rowid INTEGER PRIMARY KEY, {self._ROWS_COLUMNS})"
+        )
+        self._connection.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self._VECTORS_TABLE} USING vec0(embedding FLOAT[{self._dimensions}] distance_metric=cosine)"
+        )
+
+    def _insert(self, values, embedding):
+        """Inserts one row and its vector under the same rowid. The caller holds the lock and commits."""
+        placeholders = ",".join("?" * len(values))
+        cursor = self._connection.execute(
+            f"INSERT INTO {self._ROWS_TABLE} VALUES (NULL, {placeholders})", values
+        )
+        self._connection.execute(
+            f"INSERT INTO {self._VECTORS_TABLE} (rowid, embedding) VALUES (?, ?)",
+            (cursor.lastrowid, np.asarray(embedding, dtype=np.float32).tobytes())
+        )
+
+    def count(self):
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM {self._ROWS_TABLE}").fetchone()[0]
+
+    def index_key(self):
+        with self._lock:
+            row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (self._META_KEY,)).fetchone()
+        return row[0] if row else None
+
+    def reset(self, index_key):
+        with self._lock:
+            # Dropped rather than emptied so that a change of embedding dimensions is picked up too
+            self._connection.execute(f"DROP TABLE IF EXISTS {self._VECTORS_TABLE}")
+            self._connection.execute(f"DROP TABLE IF EXISTS {self._ROWS_TABLE}")
+            self._create_tables()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (self._META_KEY, index_key)
+            )
+            self._connection.commit()
+
+class SqliteVecStore(_SqliteVecTables):
+    """
+    VectorStore backed by a sqlite-vec vec0 virtual table in a single SQLite file.
+    Much lighter than ChromaDB for a corpus of a few thousand chunks.
+    """
+
+    _META_KEY = "index_key"
+    _ROWS_TABLE = "chunks"
+    _ROWS_COLUMNS = "id TEXT UNIQUE, document TEXT"
+    _VECTORS_TABLE = "vec_chunks"
+
+    def add(self, ids, documents, embeddings):
+        with self._lock:
+            for chunk_id, document, embedding in zip(ids, documents, embeddings):
+                self._insert((chunk_id, document), embedding)
+            self._connection.commit()
+
+    def query(self, query_embeddings, n_results):
+        results = {"ids": [], "documents": []}
+        with self._lock:
+            for embedding in query_embeddings:
+                rows = self._connection.execute(
+                    """
+                    WITH knn AS (
+                        SELECT rowid, distance FROM vec_chunks WHERE embedding MATCH ? AND k = ?
+                    )
+                    SELECT chunks.id, chunks.document FROM knn
+                    JOIN chunks ON chunks.rowid = knn.rowid
+                    ORDER BY knn.distance
+                    """,
+                    (np.asarray(embedding, dtype=np.float32).tobytes(), n_results)
+                ).fetchall()
+                results["ids"].append([row[0] for row in rows])
+                results["documents"].append([row[1] for row in rows])
+        return results
+
+class SqliteVecAnswerCache(_SqliteVecTables):
+    """AnswerCache backed by sqlite-vec; the generation time is a plain column, so sweeping is plain SQL."""
+
+    _META_KEY = "qa_cache_index_key"
+    _ROWS_TABLE = "qa_answers"
+    _ROWS_COLUMNS = "query TEXT, answer TEXT, ts REAL"
+    _VECTORS_TABLE = "vec_qa_answers"
+
+    def add(self, query, embedding, answer, ts):
+        with self._lock:
+            self._insert((query, answer, ts), embedding)
+            self._connection.commit()
+
+    def nearest(self, query_embedding):
+        with self._lock:
+            return self._connection.execute(
+                """
+                WITH knn AS (
+                    SELECT rowid, distance FROM vec_qa_answers WHERE embedding MATCH ? AND k = 1
+                )
+                SELECT knn.distance, qa_answers.answer, qa_answers.ts FROM knn
+                JOIN qa_answers ON qa_answers.rowid = knn.rowid
+                """,
+                (np.asarray(query_embedding, dtype=np.float32).tobytes(),)
+            ).fetchone()
+
+    def sweep(self, before_ts):
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM vec_qa_answers WHERE rowid IN (SELECT rowid FROM qa_answers WHERE ts < ?)", (before_ts,)
+            )
+            self._connection.execute("DELETE FROM qa_answers WHERE ts < ?", (before_ts,))
+            self._connection.commit()
@@ -0,0 +1,85 @@
+# embedding_cache.py
+
+import hashlib
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+
+# --- Configuration ---
+EMBEDDING_CACHE_PATH = "./embedding_cache.db"
+L1_CACHE_SIZE = 1024 # Number of vectors kept in memory on top of the SQLite store
+
+# --- Global/Cached Variables ---
+_connection = None
+_connection_lock = threading.Lock()
+
+def _get_connection():
+    """Opens (once) and returns the SQLite connection backing the cache."""
+    global _connection
+    if _connection is None:
+        _connection = sqlite3.connect(EMBEDDING_CACHE_PATH, check_same_thread=False)
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (sha256 TEXT PRIMARY KEY, vec BLOB, ts INTEGER)"
+        )
+        _connection.commit()
+    return _connection
+
+def _key(text, namespace):
+    """Cache key for a text; the namespace keeps vectors from different embedding models apart."""
+    return hashlib.sha256(f"{namespace}\x00{text}".encode("utf-8")).hexdigest()
+
+@lru_cache(maxsize=L1_CACHE_SIZE)
+def _load(key):
+    """Reads a vector from SQLite. Misses raise KeyError so lru_cache never memoizes them."""
+    with _connection_lock:
+        row = _get_connection().execute(
+            "SELECT vec FROM embeddings WHERE sha256 = ?", (key,)
+        ).fetchone()
+    if row is None:
+        raise KeyError(key)
+    vec = np.frombuffer(row[0], dtype=np.float32)
+    vec.flags.writeable = False # Shared between callers through the in-memory cache
+    return vec
+
+def get(text, namespace=""):
+    """Returns the cached embedding for `text` as a float32 array, or None on a miss."""
+    try:
+        return _load(_key(text, namespace))
+    except KeyError:
+        return None
+
+def put(text, vec, namespace=""):
+    """Stores the embedding for `text` in the on-disk cache."""
+    put_many([text], [vec], namespace)
+
+def get_many(texts, namespace=""):
+    """Returns cached embeddings for several texts (None for misses), bypassing the in-memory layer."""
+    keys = [_key(text, namespace) for text in texts]
+    found = {}
+    with _connection_lock:
+        connection = _get_connection()
+        # Stay well under SQLite's limit on bound parameters per statement
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(connection.execute(
+                f"SELECT sha256, vec FROM embeddings WHERE sha256 IN ({placeholders})", chunk
+            ))
+    return [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+
+def put_many(texts, vecs, namespace=""):
+    """Stores several embeddings in the on-disk cache in a single transaction."""
+    now = int(time.time())
+    rows = [
+        (_key(text, namespace), np.asarray(vec, dtype=np.float32).tobytes(), now)
+        for text, vec in zip(texts, vecs)
+    ]
+    with _connection_lock:
+        connection = _get_connection()
+        connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (sha256, vec, ts) VALUES (?, ?, ?)", rows
+        )
+        connection.commit()
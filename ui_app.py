@@ -1,11 +1,11 @@
 # ui_app.py
 
 import streamlit as st
-import requests
+import httpx
 import time
 
 # --- Configuration ---
-API_BASE_URL = "http://127.0.0.1:5000" # Where your Flask API is running
+API_BASE_URL = "http://127.0.0.1:5000" # Where your FastAPI server is running
 
 st.set_page_config(page_title="RAG Chatbot", page_icon="📚")
 st.title("📚 Pride and Prejudice RAG Chatbot")
@@ -19,48 +19,71 @@ if "rag_ready" not in st.session_state:
     st.session_state.rag_ready = False
 
 # --- Functions to interact with the API ---
-@st.cache_data(show_spinner="Checking RAG system status...")
+@st.cache_resource
+def get_http_client():
+    """One pooled keep-alive client per Streamlit server, reused across script reruns."""
+    return httpx.Client(base_url=API_BASE_URL, http2=True, timeout=httpx.Timeout(120.0, connect=5.0)) # Generous read timeout for LLM responses
+
+# Not cached: every poll has to reach the server to see initialization progress
 def check_rag_status_api():
+    """Returns the API's /status payload, or an empty dict if the server could not be reached."""
     try:
-        response = requests.get(f"{API_BASE_URL}/status", timeout=10)
-        response.raise_for_status() # Raise an HTTPError for bad responses (4xx or 5xx)
-        return response.json().get("status") == "ready"
-    except requests.exceptions.RequestException as e:
+        response = get_http_client().get("/status", timeout=10)
+        response.raise_for_status() # Raise an HTTPStatusError for bad responses (4xx or 5xx)
+        return response.json()
+    except httpx.HTTPError as e:
         st.error(f"Could not connect to RAG API server: {e}. Please ensure 'api_server.py' is running.")
-        return False
+        return {}
     except Exception as e:
         st.error(f"An unexpected error occurred while checking RAG status: {e}")
-        return False
+        return {}
 
-@st.cache_data(show_spinner="Waiting for RAG system to be ready...")
 def wait_for_rag_ready():
-    while not check_rag_status_api():
-        st.info("RAG system is initializing. This may take a few minutes (especially for the first run with a large knowledge base). Please wait...")
-        time.sleep(10) # Wait for 10 seconds before checking again
+    with st.spinner("Waiting for RAG system to be ready..."):
+        while True:
+            status = check_rag_status_api()
+            if status.get("status") == "ready":
+                break
+            if status.get("status") == "failed":
+                # Initialization will not be retried, so waiting longer cannot help
+                st.error(status.get("message", "RAG system initialization failed. Check the API server logs."))
+                st.stop()
+            st.info("RAG system is initializing. This may take a few minutes (especially for the first run with a large knowledge base). Please wait...")
+            time.sleep(10) # Wait for 10 seconds before checking again
     st.session_state.rag_ready = True
     st.success("RAG system is ready! You can now ask questions.")
 
 
-def get_rag_response(query):
+def stream_rag_response(query):
+    """Yields the answer as it is streamed from the API's /ask_stream Server-Sent Events endpoint."""
     try:
-        response = requests.post(f"{API_BASE_URL}/ask", json={"query": query}, timeout=120) # Increased timeout for LLM response
-        response.raise_for_status()
-        return response.json().get("answer", "Error: No answer received from API.")
-    except requests.exceptions.HTTPError as http_err:
-        if response.status_code == 503:
+        with get_http_client().stream("POST", "/ask_stream", json={"query": query}) as response:
+            if response.is_error:
+                response.read() # Load the error body so it can be shown below
+            response.raise_for_status()
+            data_lines = []
+            for line in response.iter_lines():
+                if line.startswith("data: "):
+                    data_lines.append(line[len("data: "):])
+                elif not line and data_lines:
+                    # A blank line ends the event; its data lines are rejoined with newlines
+                    yield "\n".join(data_lines)
+                    data_lines = []
+    except httpx.HTTPStatusError as http_err:
+        if http_err.response.status_code == 503:
             st.error("RAG system is still initializing. Please wait a moment and try again.")
         else:
-            st.error(f"HTTP error occurred: {http_err} - {response.text}")
-        return "An API error occurred."
-    except requests.exceptions.ConnectionError:
+            st.error(f"HTTP error occurred: {http_err} - {http_err.response.text}")
+        yield "An API error occurred."
+    except httpx.ConnectError:
         st.error("Could not connect to the RAG API server. Is 'api_server.py' running?")
-        return "Connection error."
-    except requests.exceptions.Timeout:
+        yield "Connection error."
+    except httpx.TimeoutException:
         st.error("The RAG API timed out. The LLM might be taking too long or the server is busy.")
-        return "Timeout error."
+        yield "Timeout error."
     except Exception as e:
         st.error(f"An unexpected error occurred: {e}")
-        return "An unexpected error occurred."
+        yield "An unexpected error occurred."
 
 # --- Main UI Logic ---
 
@@ -84,9 +107,8 @@ if prompt := st.chat_input("Ask me about Pride and Prejudice..."):
     # Get RAG response if system is ready
     if st.session_state.rag_ready:
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                response = get_rag_response(prompt)
-                st.markdown(response)
+            # The answer is rendered token by token as it streams in
+            response = st.write_stream(stream_rag_response(prompt))
             # Add assistant response to chat history
             st.session_state.messages.append({"role": "assistant", "content": response})
     else: